@@ -68,8 +68,10 @@ class Platform(XilinxPlatform):
     default_clk_name   = "clk200"
     default_clk_period = 1e9/200e6
 
-    def __init__(self):
+    def __init__(self, compress=True, configrate=None):
         XilinxPlatform.__init__(self, "xcvu33p-fsvh2104-2L-e-es1", _io, toolchain="vivado")
+        self.compress   = compress
+        self.configrate = configrate
 
     def create_programmer(self):
         return VivadoProgrammer()
@@ -77,10 +79,13 @@ class Platform(XilinxPlatform):
     def do_finalize(self, fragment):
         XilinxPlatform.do_finalize(self, fragment)
         self.add_period_constraint(self.lookup_request("clk200", loose=True), 1e9/200e6)
-        # Shutdown on overheatng
+        # Shutdown on overheating
         self.add_platform_command("set_property BITSTREAM.CONFIG.OVERTEMPSHUTDOWN ENABLE [current_design]")
         # Reduce programming time
-        self.add_platform_command("set_property BITSTREAM.GENERAL.COMPRESS TRUE [current_design]")
+        if self.compress:
+            self.add_platform_command("set_property BITSTREAM.GENERAL.COMPRESS TRUE [current_design]")
+        if self.configrate is not None:
+            self.add_platform_command(f"set_property BITSTREAM.CONFIG.CONFIGRATE {self.configrate} [current_design]")
 
 # CRG ----------------------------------------------------------------------------------------------
 
@@ -98,13 +103,14 @@ class _CRG(Module):
         pll.create_clkout(self.cd_sys,     sys_clk_freq)
         pll.create_clkout(self.cd_hbm_ref, 100e6)
         pll.create_clkout(self.cd_apb,     100e6)
-        platform.add_false_path_constraints(self.cd_sys.clk, self.cd_apb.clk)
+        platform.add_false_path_constraints(self.cd_sys.clk, self.cd_hbm_ref.clk, self.cd_apb.clk)
 
 # BaseSoC ------------------------------------------------------------------------------------------
 
 class BaseSoC(SoCCore):
-    def __init__(self, sys_clk_freq=int(250e6), with_hbm=False, with_analyzer=False, **kwargs):
-        platform = Platform()
+    def __init__(self, sys_clk_freq=int(250e6), with_hbm=False, with_analyzer=False,
+        compress=True, configrate=None, hbm_refresh_holdoff=False, **kwargs):
+        platform = Platform(compress=compress, configrate=configrate)
 
         # SoCCore ----------------------------------------------------------------------------------
         kwargs["uart_name"] = "crossover"
@@ -121,17 +127,19 @@ class BaseSoC(SoCCore):
 
         # Leds -------------------------------------------------------------------------------------
         self.submodules.leds = LedChaser(
-            pads         = Cat(*[platform.request("user_led", i) for i in range(7)]),
+            pads         = platform.request_all("user_led"),
             sys_clk_freq = sys_clk_freq)
 
         # HBM --------------------------------------------------------------------------------------
         if with_hbm:
             # Add HBM Core.
-            self.submodules.hbm = hbm = ClockDomainsRenamer({"axi": "sys"})(HBMIP(platform))
+            self.submodules.hbm = hbm = ClockDomainsRenamer({"axi": "sys"})(HBMIP(platform,
+                num_axi         = 4,
+                refresh_holdoff = hbm_refresh_holdoff,
+                build_dir       = os.path.join(_output_dir, "gateware")))
 
-            # Connect four of the HBM's AXI interfaces to the main bus of the SoC.
-            for i in range(4):
-                axi_hbm      = hbm.axi[i]
+            # Connect the HBM's AXI interfaces to the main bus of the SoC.
+            for i, axi_hbm in enumerate(hbm.axi):
                 axi_lite_hbm = AXILiteInterface(data_width=256, address_width=33)
                 self.submodules += AXILite2AXI(axi_lite_hbm, axi_hbm)
                 self.bus.add_slave(f"hbm{i}", axi_lite_hbm, SoCRegion(origin=0x4000_0000 + 0x1000_0000*i, size=0x1000_0000)) # 256MB.
@@ -150,22 +158,56 @@ class BaseSoC(SoCCore):
 
 # Build --------------------------------------------------------------------------------------------
 
+_output_dir = "build/fk33"
+
+def load_bitstream(platform):
+    # Builder's default gateware dir and build name (platform.name) are used by both build paths.
+    prog = platform.create_programmer()
+    prog.load_bitstream(os.path.join(_output_dir, "gateware", platform.name + ".bit"))
+
 def main():
     parser = argparse.ArgumentParser(description="LiteX HBM2 Test SoC on Forest Kitten 33.")
-    parser.add_argument("--build",         action="store_true", help="Build bitstream.")
-    parser.add_argument("--load",          action="store_true", help="Load bitstream.")
-    parser.add_argument("--with-hbm",      action="store_true", help="Use HBM.")
-    parser.add_argument("--with-analyzer", action="store_true", help="Enable Analyzer.")
+    parser.add_argument("--build",               action="store_true", help="Build bitstream.")
+    parser.add_argument("--load",                action="store_true", help="Load bitstream.")
+    parser.add_argument("--with-hbm",            action="store_true", help="Use HBM.")
+    parser.add_argument("--with-analyzer",       action="store_true", help="Enable Analyzer.")
+    parser.add_argument("--no-compress",         action="store_true", help="Disable bitstream compression.")
+    parser.add_argument("--configrate",          default=None, type=float, help="Bitstream configuration rate in MHz (ex: 33.0).")
+    parser.add_argument("--timing-explore",      action="store_true", help="Use Vivado Explore directives (better timing, longer build).")
+    parser.add_argument("--incremental",         action="store_true", help="Use previous routed checkpoint for Vivado incremental implementation.")
+    parser.add_argument("--hbm-refresh-holdoff", action="store_true", help="Hold off HBM refreshes during read/write bursts.")
     soc_core_args(parser)
     args = parser.parse_args()
 
-    soc = BaseSoC(with_hbm=args.with_hbm, with_analyzer=args.with_analyzer, **soc_core_argdict(args))
-    builder = Builder(soc, output_dir="build/fk33", csr_csv="csr.csv")
+    # Load only: bitstream is already built, no need to elaborate the SoC.
+    if args.load and not args.build:
+        load_bitstream(Platform())
+        return
+
+    soc = BaseSoC(
+        with_hbm            = args.with_hbm,
+        with_analyzer       = args.with_analyzer,
+        compress            = not args.no_compress,
+        configrate          = args.configrate,
+        hbm_refresh_holdoff = args.hbm_refresh_holdoff,
+        **soc_core_argdict(args)
+    )
+    if args.timing_explore:
+        toolchain = soc.platform.toolchain
+        toolchain.vivado_synth_directive               = "AlternateRoutability"
+        toolchain.opt_directive                        = "ExploreWithRemap"
+        toolchain.vivado_place_directive               = "ExtraTimingOpt"
+        toolchain.vivado_post_place_phys_opt_directive = "AggressiveExplore"
+        toolchain.vivado_route_directive               = "AggressiveExplore"
+    builder = Builder(soc, output_dir=_output_dir, csr_csv="csr.csv")
+    if args.incremental:
+        # Only enabled when a previous routed checkpoint exists.
+        checkpoint = os.path.join(builder.gateware_dir, soc.platform.name + "_route.dcp")
+        soc.platform.toolchain.incremental_implementation = os.path.exists(checkpoint)
     builder.build(run=args.build)
 
     if args.load:
-        prog = soc.platform.create_programmer()
-        prog.load_bitstream(os.path.join(builder.gateware_dir, soc.build_name + ".bit"))
+        load_bitstream(soc.platform)
 
 if __name__ == "__main__":
     main()
@@ -6,20 +6,73 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
+from operator import attrgetter
 
 from migen import *
+from migen.genlib.cdc import MultiReg, BusSynchronizer
 
-from litex.soc.cores.clock import *
-from litex.soc.integration.soc_core import *
-from litex.soc.integration.builder import *
 from litex.soc.interconnect.axi import *
 from litex.soc.interconnect.csr import *
 
+# AXI Port Parameters ------------------------------------------------------------------------------
+
+# Direction, HBM IP port name (without AXI_xx_ prefix) and AXIInterface signal of each AXI port.
+_axi_port_params = [(d, name, attrgetter(path)) for d, name, path in [
+    # AW Channel.
+    ("i", "AWADDR",  "aw.addr"),
+    ("i", "AWBURST", "aw.burst"),
+    ("i", "AWID",    "aw.id"),
+    ("i", "AWLEN",   "aw.len"),
+    ("i", "AWSIZE",  "aw.size"),
+    ("i", "AWVALID", "aw.valid"),
+    ("o", "AWREADY", "aw.ready"),
+
+    # W Channel.
+    ("i", "WDATA",   "w.data"),
+    ("i", "WLAST",   "w.last"),
+    ("i", "WSTRB",   "w.strb"),
+    ("i", "WVALID",  "w.valid"),
+    ("o", "WREADY",  "w.ready"),
+
+    # B Channel.
+    ("o", "BID",     "b.id"),
+    ("o", "BRESP",   "b.resp"),
+    ("o", "BVALID",  "b.valid"),
+    ("i", "BREADY",  "b.ready"),
+
+    # AR Channel.
+    ("i", "ARADDR",  "ar.addr"),
+    ("i", "ARBURST", "ar.burst"),
+    ("i", "ARID",    "ar.id"),
+    ("i", "ARLEN",   "ar.len"),
+    ("i", "ARSIZE",  "ar.size"),
+    ("i", "ARVALID", "ar.valid"),
+    ("o", "ARREADY", "ar.ready"),
+
+    # R Channel.
+    ("o", "RDATA",   "r.data"),
+    ("o", "RID",     "r.id"),
+    ("o", "RLAST",   "r.last"),
+    ("o", "RRESP",   "r.resp"),
+    ("o", "RVALID",  "r.valid"),
+    ("i", "RREADY",  "r.ready"),
+]]
+
+# Instance parameter names of each of the 32 AXI ports, formatted once at import.
+_axi_port_keys = [[(f"{d}_AXI_{i:02d}_{name}", getter) for d, name, getter in _axi_port_params] for i in range(32)]
+
+# HBM IP -------------------------------------------------------------------------------------------
+
 class HBMIP(Module, AutoCSR):
     """Xilinx Virtex US+ High Bandwidth Memory 2 IP wrapper"""
-    def __init__(self, platform, hbm_ip_name="hbm_0"):
-        self.platform = platform
-        self.hbm_name = hbm_ip_name
+    def __init__(self, platform, hbm_ip_name="hbm_0", num_axi=32, refresh_holdoff=False, build_dir=None):
+        assert 1 <= num_axi <= 32
+        if refresh_holdoff and build_dir is None:
+            raise ValueError("HBMIP: refresh_holdoff requires a build_dir for the configured .xci copy.")
+        self.platform        = platform
+        self.hbm_name        = hbm_ip_name
+        self.refresh_holdoff = refresh_holdoff
+        self.build_dir       = build_dir
 
         self.axi = []
         self.apb = []
@@ -27,71 +80,44 @@ class HBMIP(Module, AutoCSR):
         self.hbm_params = {}
 
         self.init_done = CSRStatus()
+        self.dram_stat = CSRStatus(fields=[
+            CSRField("temp0",    size=7, description="HBM Stack 0 temperature (Celsius)."),
+            CSRField("temp1",    size=7, description="HBM Stack 1 temperature (Celsius)."),
+            CSRField("cattrip0", size=1, description="HBM Stack 0 catastrophic temperature trip."),
+            CSRField("cattrip1", size=1, description="HBM Stack 1 catastrophic temperature trip."),
+        ])
 
         # # #
 
-        class Open(Signal): pass
-
         # Clocks -----------------------------------------------------------------------------------
         # Ref = 100 MHz (HBM: 900 (225-900) MHz), drives internal PLL (1 per stack).
         for i in range(2):
             self.hbm_params[f"i_HBM_REF_CLK_{i:1d}"] = ClockSignal("hbm_ref")
 
+        # Resets (active low, shared by APB and AXI ports).
+        apb_rst_n = Signal()
+        self.comb += apb_rst_n.eq(~ResetSignal("apb"))
+
         # APB: 100 (50-100) MHz
         for i in range(2):
             self.hbm_params[f"i_APB_{i:1d}_PCLK"]     = ClockSignal("apb")
-            self.hbm_params[f"i_APB_{i:1d}_PRESET_N"] = ~ResetSignal("apb")
+            self.hbm_params[f"i_APB_{i:1d}_PRESET_N"] = apb_rst_n
 
         # AXI: 450 (225-450) MHz
         for i in range(32):
             self.hbm_params[f"i_AXI_{i:02d}_ACLK"]     = ClockSignal("axi")
-            self.hbm_params[f"i_AXI_{i:02d}_ARESET_N"] = ~ResetSignal("apb")
+            self.hbm_params[f"i_AXI_{i:02d}_ARESET_N"] = apb_rst_n
 
         # AXI --------------------------------------------------------------------------------------
         for i in range(32):
-            axi = AXIInterface(data_width=256, address_width=33, id_width=6)
-            self.axi.append(axi)
-
-            # AW Channel.
-            self.hbm_params[f"i_AXI_{i :02d}_AWADDR"]      = axi.aw.addr
-            self.hbm_params[f"i_AXI_{i :02d}_AWBURST"]     = axi.aw.burst
-            self.hbm_params[f"i_AXI_{i :02d}_AWID"]        = axi.aw.id
-            self.hbm_params[f"i_AXI_{i :02d}_AWLEN"]       = axi.aw.len
-            self.hbm_params[f"i_AXI_{i :02d}_AWSIZE"]      = axi.aw.size
-            self.hbm_params[f"i_AXI_{i :02d}_AWVALID"]     = axi.aw.valid
-            self.hbm_params[f"o_AXI_{i :02d}_AWREADY"]     = axi.aw.ready
-
-            # W Channel.
-            self.hbm_params[f"i_AXI_{i:02d}_WDATA"]        = axi.w.data
-            self.hbm_params[f"i_AXI_{i:02d}_WLAST"]        = axi.w.last
-            self.hbm_params[f"i_AXI_{i:02d}_WSTRB"]        = axi.w.strb
-            self.hbm_params[f"i_AXI_{i:02d}_WDATA_PARITY"] = 0 # FIXME: Manage parity?
-            self.hbm_params[f"i_AXI_{i:02d}_WVALID"]       = axi.w.valid
-            self.hbm_params[f"o_AXI_{i:02d}_WREADY"]       = axi.w.ready
-
-            # B Channel.
-            self.hbm_params[f"o_AXI_{i:02d}_BID"]          = axi.b.id
-            self.hbm_params[f"o_AXI_{i:02d}_BRESP"]        = axi.b.resp
-            self.hbm_params[f"o_AXI_{i:02d}_BVALID"]       = axi.b.valid
-            self.hbm_params[f"i_AXI_{i:02d}_BREADY"]       = axi.b.ready
-
-            # AR Channel.
-            self.hbm_params[f"i_AXI_{i:02d}_ARADDR"]       = axi.ar.addr
-            self.hbm_params[f"i_AXI_{i:02d}_ARBURST"]      = axi.ar.burst
-            self.hbm_params[f"i_AXI_{i:02d}_ARID"]         = axi.ar.id
-            self.hbm_params[f"i_AXI_{i:02d}_ARLEN"]        = axi.ar.len
-            self.hbm_params[f"i_AXI_{i:02d}_ARSIZE"]       = axi.ar.size
-            self.hbm_params[f"i_AXI_{i:02d}_ARVALID"]      = axi.ar.valid
-            self.hbm_params[f"o_AXI_{i:02d}_ARREADY"]      = axi.ar.ready
-
-            # R Channel.
-            self.hbm_params[f"o_AXI_{i:02d}_RDATA_PARITY"] = Open() # FIXME: Manage parity?
-            self.hbm_params[f"o_AXI_{i:02d}_RDATA"]        = axi.r.data
-            self.hbm_params[f"o_AXI_{i:02d}_RID"]          = axi.r.id
-            self.hbm_params[f"o_AXI_{i:02d}_RLAST"]        = axi.r.last
-            self.hbm_params[f"o_AXI_{i:02d}_RRESP"]        = axi.r.resp
-            self.hbm_params[f"o_AXI_{i:02d}_RVALID"]       = axi.r.valid
-            self.hbm_params[f"i_AXI_{i:02d}_RREADY"]       = axi.r.ready
+            if i < num_axi:
+                axi = AXIInterface(data_width=256, address_width=33, id_width=6)
+                self.axi.append(axi)
+                self.hbm_params.update({key: getter(axi) for key, getter in _axi_port_keys[i]})
+            else:
+                # Unused port: tie inputs to 0, leave outputs unconnected.
+                self.hbm_params.update({key: 0 for key, _ in _axi_port_keys[i] if key.startswith("i_")})
+            self.hbm_params[f"i_AXI_{i:02d}_WDATA_PARITY"] = 0 # FIXME: Manage parity? (RDATA_PARITY left unconnected).
 
         # APB --------------------------------------------------------------------------------------
         # FIXME: Connect to CSR or Wishbone.
@@ -102,22 +128,55 @@ class HBMIP(Module, AutoCSR):
             self.hbm_params[f"i_APB_{i:1d}_PENABLE"] = 0
             self.hbm_params[f"i_APB_{i:1d}_PSEL"]    = 0
             self.hbm_params[f"i_APB_{i:1d}_PWRITE"]  = 0
-
-            self.hbm_params[f"o_APB_{i:1d}_PRDATA"]  = Open()
-            self.hbm_params[f"o_APB_{i:1d}_PREADY"]  = Open()
-            self.hbm_params[f"o_APB_{i:1d}_PSLVERR"] = Open()
+            # PRDATA/PREADY/PSLVERR left unconnected.
 
             self.hbm_params[f"o_apb_complete_{i:1d}"] = apb_complete[i]
         self.comb += self.init_done.status.eq(apb_complete == 0b11)
 
         # Temperature ------------------------------------------------------------------------------
+        # Status is generated in the APB domain: resynchronize it before the CSR (the temperature
+        # through a BusSynchronizer so that a multi-bit step is never sampled torn).
         for i in range(2):
-            self.hbm_params[f"o_DRAM_{i:1d}_STAT_CATTRIP"] = Open()
-            self.hbm_params[f"o_DRAM_{i:1d}_STAT_TEMP"]    = Open()
+            cattrip   = Signal()
+            temp_sync = BusSynchronizer(7, "apb", "sys")
+            self.submodules += temp_sync
+            self.hbm_params[f"o_DRAM_{i:1d}_STAT_CATTRIP"] = cattrip
+            self.hbm_params[f"o_DRAM_{i:1d}_STAT_TEMP"]    = temp_sync.i
+            self.specials += MultiReg(cattrip, getattr(self.dram_stat.fields, f"cattrip{i}"))
+            self.comb += getattr(self.dram_stat.fields, f"temp{i}").eq(temp_sync.o)
+
+    def configure_refresh_holdoff(self, xci):
+        # Hold off refreshes during read/write bursts on the 16 memory controllers (2 stacks x 8 MCs).
+        # Done on a copy of the .xci in the build directory: the IP is configured before being read
+        # (so only generated/synthesized once) and the repository's .xci is left untouched.
+        with open(xci, "r") as f:
+            xci_content = f.read()
+        anchor = '<xilinx:configElementInfo xilinx:referenceId="PARAM_VALUE.USER_HBM_STACK" xilinx:valueSource="user"/>'
+        if xci_content.count(anchor) != 1:
+            raise ValueError(f"{xci}: USER_HBM_STACK user entry not found.")
+        for i in range(16):
+            param = f"PARAM_VALUE.USER_MC{i}_BURST_RW_REFRESH_HOLDOFF"
+            value = f'<spirit:configurableElementValue spirit:referenceId="{param}">'
+            user  = f'<xilinx:configElementInfo xilinx:referenceId="{param}" xilinx:valueSource="user"/>'
+            if xci_content.count(value + "false<") == 1:
+                xci_content = xci_content.replace(value + "false<", value + "true<")
+            # An already enabled hold-off (ex: .xci saved from Vivado with it set) is kept as is.
+            elif xci_content.count(value + "true<") != 1:
+                raise ValueError(f"{xci}: {param} value not found.")
+            if user not in xci_content:
+                xci_content = xci_content.replace(anchor, anchor + "\n" + " "*12 + user)
+        os.makedirs(self.build_dir, exist_ok=True)
+        xci = os.path.join(os.path.abspath(self.build_dir), os.path.basename(xci))
+        with open(xci, "w") as f:
+            f.write(xci_content)
+        return xci
 
     def add_sources(self, platform):
         this_dir = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
-        platform.add_ip(os.path.join(this_dir, "ip", "hbm", self.hbm_name + ".xci"))
+        xci = os.path.join(this_dir, "ip", "hbm", self.hbm_name + ".xci")
+        if self.refresh_holdoff:
+            xci = self.configure_refresh_holdoff(xci)
+        platform.add_ip(xci)
 
     def do_finalize(self):
         self.add_sources(self.platform)